@@ -0,0 +1,76 @@
+from array import array
+from datetime import datetime
+
+# Statistiques sur l'historique des réservations.
+# Les fonctions de calcul tournent dans un processus séparé : le serveur ne fait
+# qu'une copie brute des champs (take_snapshot), l'analyse des dates et la mise
+# en colonnes (tableaux compacts) se font dans le worker (to_columns).
+
+WEEKDAYS = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
+
+def take_snapshot(data):
+    # Exécuté dans le serveur : doit rester une simple copie, sans analyse
+    rows = [(d.get("date"), d.get("time"), d.get("size"), d.get("created_at"), d.get("email"))
+            for d in list(data.get("bookings_details", []))]
+    config = data["config"]
+    return {
+        "rows": rows,
+        "default_capacity": config["default_capacity"],
+        "hours": list(range(config["opening_hour"], config["closing_hour"])),
+    }
+
+def to_columns(snap):
+    day, hour, size, lead, client = array("l"), array("b"), array("h"), array("l"), array("q")
+    for r_date, r_time, r_size, r_created, r_email in snap["rows"]:
+        # Une réservation mal formée est ignorée plutôt que de bloquer tous les rapports
+        try:
+            when = datetime.strptime(r_date, "%Y-%m-%d")
+            s = int(r_size or 0)
+        except (TypeError, ValueError): continue
+        if not 0 <= s <= 32767: continue  # limites de array("h")
+        try: h = int(str(r_time or "").split(":")[0])
+        except ValueError: h = -1
+        if not 0 <= h < 24: h = -1  # heure illisible : comptée nulle part dans covers_by_hour
+        try: created = datetime.strptime(r_created or "", "%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError): created = when
+        day.append(when.toordinal()); hour.append(h); size.append(s)
+        lead.append((when - created.replace(hour=0, minute=0, second=0)).days)
+        client.append(hash(str(r_email or "")))
+    return {"day": day, "hour": hour, "size": size, "lead": lead, "client": client}
+
+def weekday_report(snap):
+    cols = to_columns(snap)
+    bookings, covers = [0] * 7, [0] * 7
+    days_seen = [set() for _ in range(7)]
+    by_hour = [{} for _ in range(7)]
+    for o, h, s in zip(cols["day"], cols["hour"], cols["size"]):
+        wd = (o - 1) % 7  # toordinal() : le 1er janvier de l'an 1 est un lundi
+        bookings[wd] += 1; covers[wd] += s; days_seen[wd].add(o)
+        by_hour[wd][h] = by_hour[wd].get(h, 0) + s
+    day_capacity = snap["default_capacity"] * len(snap["hours"])
+    out = []
+    for wd in range(7):
+        n_days = len(days_seen[wd])
+        out.append({
+            "weekday": WEEKDAYS[wd], "days": n_days, "bookings": bookings[wd], "covers": covers[wd],
+            "avg_party": round(covers[wd] / bookings[wd], 2) if bookings[wd] else 0,
+            "occupancy": round(covers[wd] / (n_days * day_capacity), 3) if n_days and day_capacity else 0,
+            "covers_by_hour": {f"{h:02d}:00": by_hour[wd].get(h, 0) for h in snap["hours"]},
+        })
+    return out
+
+def monthly_report(snap):
+    cols = to_columns(snap)
+    months = {}
+    for o, s, l, c in zip(cols["day"], cols["size"], cols["lead"], cols["client"]):
+        d = datetime.fromordinal(o)
+        m = months.setdefault(f"{d.year}-{d.month:02d}", {"bookings": 0, "covers": 0, "lead": 0, "clients": set()})
+        m["bookings"] += 1; m["covers"] += s; m["lead"] += l; m["clients"].add(c)
+    return [{
+        "month": k, "bookings": m["bookings"], "covers": m["covers"],
+        "avg_party": round(m["covers"] / m["bookings"], 2),
+        "avg_lead_days": round(m["lead"] / m["bookings"], 1),
+        "distinct_clients": len(m["clients"]),
+    } for k, m in sorted(months.items())]
+
+REPORTS = {"weekday": weekday_report, "monthly": monthly_report}
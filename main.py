@@ -1,15 +1,86 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import json
+import multiprocessing
 import os
 import re
+import threading
+import time
 import traceback
+import analytics
 
 app = FastAPI()
 
+# --- ANTI-SURCHARGE : limitation de débit et contrôle d'admission ---
+RATE_LIMIT_RATE = 1.0  # jetons rendus par seconde et par client
+RATE_LIMIT_BURST = 10  # rafale maximale autorisée
+RATE_LIMIT_MAX_KEYS = 10000  # nombre de clients suivis (les plus anciens sont oubliés)
+MAX_INFLIGHT = 32  # requêtes protégées traitées en parallèle au maximum
+MAX_LATENCY = 2.0  # secondes, moyenne glissante au-delà de laquelle on déleste
+LATENCY_HALF_LIFE = 5.0  # secondes pour que la moyenne diminue de moitié sans nouvelle mesure
+MAX_CHAT_SESSIONS = 5000
+PROTECTED_PATHS = {"/api/chat", "/api/reserve"}
+
+class RateLimiter:
+    def __init__(self, rate, burst, max_keys):
+        self.rate, self.burst, self.max_keys = rate, burst, max_keys
+        self.buckets = OrderedDict()  # clé -> (jetons, dernier passage)
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed: tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys: self.buckets.popitem(last=False)
+            if not allowed: self.rejected += 1
+            return allowed
+
+ip_limiter = RateLimiter(RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_MAX_KEYS)
+client_limiter = RateLimiter(RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_MAX_KEYS)
+admission = {"inflight": 0, "latency": 0.0, "latency_at": 0.0, "shed": 0}  # modifié uniquement par le middleware
+
+def current_latency(now):
+    # La moyenne s'estompe avec le temps écoulé depuis la dernière mesure
+    return admission["latency"] * 0.5 ** ((now - admission["latency_at"]) / LATENCY_HALF_LIFE)
+
+def too_many_requests(path, reason):
+    msg = f"⏳ Trop de demandes ({reason}), réessayez dans un instant."
+    content = {"response": msg} if path == "/api/chat" else {"action": "REJECT", "message": msg}
+    return JSONResponse(status_code=429, content=content, headers={"Retry-After": "1"})
+
+# Déclaré avant CORS pour que les réponses 429 gardent les en-têtes CORS
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    path = request.url.path
+    if path not in PROTECTED_PATHS: return await call_next(request)
+    if not ip_limiter.allow(request.client.host if request.client else "?"):
+        return too_many_requests(path, "limite par client")
+    start = time.monotonic()
+    inflight = admission["inflight"]
+    # Sans requête en cours, une latence passée ne justifie pas de refuser
+    if inflight >= MAX_INFLIGHT or (inflight > 0 and current_latency(start) > MAX_LATENCY):
+        admission["shed"] += 1
+        return too_many_requests(path, "serveur saturé")
+    admission["inflight"] += 1
+    try: return await call_next(request)
+    finally:
+        admission["inflight"] -= 1
+        now = time.monotonic()
+        admission["latency"] = 0.8 * current_latency(now) + 0.2 * (now - start)
+        admission["latency_at"] = now
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -19,14 +90,27 @@ app.add_middleware(
 )
 
 DATA_FILE = "agent_data.json"
-chat_sessions = {} 
+chat_sessions = OrderedDict()  # client_id -> session, de la moins récemment utilisée à la plus récente
+chat_sessions_lock = threading.Lock()
+CALENDAR_MAX_DAYS = 366  # taille maximale d'une plage pour /api/calendar
+TABLE_CACHE_SIZE = 256  # nombre de dates dont on garde le placement des tables
+SLOTS_CACHE_SIZE = 256  # nombre de dates gardées en cache pour /api/slots
+slots_cache = OrderedDict()  # date -> (version, réponse JSON déjà sérialisée)
+slots_cache_stats = {"hits": 0, "misses": 0}
+slots_cache_lock = threading.Lock()
+ANALYTICS_TTL = 300  # secondes pendant lesquelles un rapport calculé est réutilisé
+ANALYTICS_WORKERS = 2
+analytics_pool = None  # créé à la première demande de rapport
+analytics_cache = {}  # rapport -> (expiration, future, pool)
+analytics_lock = threading.Lock()
 
 default_data = {
     "config": {
         "opening_hour": 11,
         "closing_hour": 23,
         "default_capacity": 10,
-        "peak_hours": ["19:00", "20:00"]
+        "peak_hours": ["19:00", "20:00"],
+        "tables": []
     },
     "messages": { "success": "Confirmé.", "alternative": "Complet.", "failure": "Complet." },
     "reservations": {}, "overrides": {}, "bookings_details": []
@@ -52,12 +136,18 @@ class ReservationRequest(BaseModel):
     date: str; time: str; firstname: str; lastname: str; email: str; party_size: int
 class ChatMessage(BaseModel): message: str; client_id: str
 class SlotOverride(BaseModel): date: str; time: str; capacity: int
-class GlobalConfigUpdate(BaseModel): opening_hour: int; closing_hour: int; default_capacity: int; messages: Dict[str, str]
+class TableType(BaseModel): size: int = Field(..., ge=1); count: int = Field(..., ge=0); combinable: bool = False
+class GlobalConfigUpdate(BaseModel): opening_hour: int; closing_hour: int; default_capacity: int; messages: Dict[str, str]; tables: Optional[List[TableType]] = None
 class AdminSlotUpdate(BaseModel): date: str; time: str; booked: int; capacity: int
 
 # --- IA ENGINE ---
 class IntelligentAgent:
-    def __init__(self): self.data = load_data()
+    def __init__(self):
+        self.data = load_data()
+        self.table_cache = OrderedDict()  # date -> {time: tables libres [(taille, combinable)] triées}, seulement les créneaux occupés
+        self.table_lock = threading.RLock()
+        self.versions = {}  # date -> version des données du jour
+        self.global_version = 0  # change à chaque modification de la config
 
     def parse_natural_language(self, text):
         text = text.lower().strip()
@@ -114,6 +204,87 @@ class IntelligentAgent:
         if date in self.data["overrides"] and time in self.data["overrides"][date]: return self.data["overrides"][date][time]
         return self.data["config"]["default_capacity"]
 
+    # --- TABLES : plan de salle et placement des groupes ---
+    def initial_tables(self):
+        tables = [(t["size"], t.get("combinable", False)) for t in self.data["config"].get("tables") or [] for _ in range(t["count"])]
+        tables.sort()
+        return tables
+
+    def pick_tables(self, free, size):
+        # Best-fit : la plus petite table qui suffit seule
+        for i, (t_size, _) in enumerate(free):
+            if t_size >= size: return [i]
+        # Sinon on assemble des tables combinables : les plus grandes d'abord, puis best-fit sur le reste
+        comb = [i for i, (_, c) in enumerate(free) if c]
+        chosen, need = [], size
+        while comb and need > 0:
+            fit = next((i for i in comb if free[i][0] >= need), None)
+            i = fit if fit is not None else comb[-1]
+            chosen.append(i); comb.remove(i); need -= free[i][0]
+        return chosen if need <= 0 else None
+
+    def allocate(self, free, size):
+        chosen = self.pick_tables(free, size)
+        if chosen is None: return None
+        for i in sorted(chosen, reverse=True): del free[i]
+        return chosen
+
+    def build_free_tables(self, dates):
+        # Un seul passage sur l'historique, quel que soit le nombre de dates demandées
+        days = {date: {} for date in dates}
+        by_slot = {}
+        for d in self.data.get("bookings_details", []):
+            if d.get("date") in days: by_slot.setdefault((d["date"], d.get("time")), []).append(d.get("size", 0))
+        for (date, t), sizes in by_slot.items():
+            free = self.initial_tables()
+            for size in sizes: self.allocate(free, size)
+            days[date][t] = free
+        return days
+
+    def store_day(self, date, day):
+        self.table_cache[date] = day
+        self.table_cache.move_to_end(date)
+        if len(self.table_cache) > TABLE_CACHE_SIZE: self.table_cache.popitem(last=False)
+
+    def get_free_tables(self, date, time):
+        # À appeler sous table_lock : la liste renvoyée peut être celle du cache
+        with self.table_lock:
+            if date in self.table_cache: self.table_cache.move_to_end(date)
+            else: self.store_day(date, self.build_free_tables([date])[date])
+            day = self.table_cache[date]
+            return day[time] if time in day else self.initial_tables()
+
+    def data_version(self, date):
+        return self.global_version, self.versions.get(date, 0)
+
+    def invalidate(self, date=None):
+        with self.table_lock:
+            if date is None:
+                self.table_cache.clear()
+                self.global_version += 1
+            else:
+                self.table_cache.pop(date, None)
+                self.versions[date] = self.versions.get(date, 0) + 1
+
+    def can_seat(self, date, time, size):
+        if size < 1: return False
+        cap = self.get_slot_capacity(date, time)
+        booked = self.data["reservations"].get(date, {}).get(time, 0)
+        if cap <= 0 or (cap - booked) < size: return False
+        if not self.data["config"].get("tables"): return True
+        with self.table_lock: return self.pick_tables(self.get_free_tables(date, time), size) is not None
+
+    def max_party(self, date, time, day_tables=None):
+        cap = self.get_slot_capacity(date, time)
+        free_seats = max(0, cap - self.data["reservations"].get(date, {}).get(time, 0))
+        if not self.data["config"].get("tables"): return free_seats
+        with self.table_lock:
+            if day_tables is None: free = self.get_free_tables(date, time)
+            else: free = day_tables[time] if time in day_tables else self.initial_tables()
+            largest = max((t_size for t_size, _ in free), default=0)
+            combined = sum(t_size for t_size, c in free if c)
+        return min(free_seats, max(largest, combined))
+
     def calculate_score(self, target_time, candidate_time, current_load, capacity):
         if capacity == 0: return -1
         fmt = "%H:%M"
@@ -138,10 +309,10 @@ class IntelligentAgent:
 
         for h in range(config["opening_hour"], config["closing_hour"]):
             t_str = f"{h:02d}:00"
+            if not self.can_seat(date, t_str, size_to_check): continue
             cap = self.get_slot_capacity(date, t_str)
             booked = beliefs.get(t_str, 0)
-            
-            if (cap - booked) < size_to_check: continue
+
             if requested_time and t_str == requested_time: return {"time": t_str, "score": 10000, "is_exact": True}
             
             # Filtre : on garde tout dans la journée
@@ -152,42 +323,56 @@ class IntelligentAgent:
         return candidates[0] if candidates else None
 
     def analyze_day_status(self, date):
-        beliefs = self.data["reservations"].get(date, {})
         config = self.data["config"]
         max_free = 0
         best_time_for_max = None
         for h in range(config["opening_hour"], config["closing_hour"]):
             t_str = f"{h:02d}:00"
-            cap = self.get_slot_capacity(date, t_str)
-            booked = beliefs.get(t_str, 0)
-            free = cap - booked
+            free = self.max_party(date, t_str)
             if free > max_free:
                 max_free = free
                 best_time_for_max = t_str
         return max_free, best_time_for_max
 
     def get_all_available_slots(self, date, party_size):
-        beliefs = self.data["reservations"].get(date, {})
         config = self.data["config"]
         available = []
         size_to_check = party_size if party_size else 2
         for h in range(config["opening_hour"], config["closing_hour"]):
             t_str = f"{h:02d}:00"
-            cap = self.get_slot_capacity(date, t_str)
-            booked = beliefs.get(t_str, 0)
-            if (cap - booked) >= size_to_check and cap > 0: available.append(t_str)
+            if self.can_seat(date, t_str, size_to_check): available.append(t_str)
         return available
 
+    def day_summary(self, date, party_size, day_tables=None):
+        config = self.data["config"]
+        max_free, open_slots = 0, 0
+        for h in range(config["opening_hour"], config["closing_hour"]):
+            free = self.max_party(date, f"{h:02d}:00", day_tables)
+            if free > max_free: max_free = free
+            if free >= party_size: open_slots += 1
+        return {"date": date, "max_free": max_free, "open_slots": open_slots, "full": max_free == 0}
+
     def commit_booking(self, date, time, size, name="Inconnu", email="Non renseigné"):
-        if date not in self.data["reservations"]: self.data["reservations"][date] = {}
-        curr = self.data["reservations"][date].get(time, 0)
-        self.data["reservations"][date][time] = curr + size
-        if "bookings_details" not in self.data: self.data["bookings_details"] = []
-        self.data["bookings_details"].append({
-            "date": date, "time": time, "name": name, "email": email, "size": size,
-            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
+        # Vérification et enregistrement sous le même verrou : deux groupes ne peuvent pas obtenir la même table,
+        # et un calcul du plan de salle ne peut pas rater cette réservation
+        with self.table_lock:
+            if not self.can_seat(date, time, size): return False
+            if date not in self.data["reservations"]: self.data["reservations"][date] = {}
+            curr = self.data["reservations"][date].get(time, 0)
+            self.data["reservations"][date][time] = curr + size
+            if "bookings_details" not in self.data: self.data["bookings_details"] = []
+            self.data["bookings_details"].append({
+                "date": date, "time": time, "name": name, "email": email, "size": size,
+                "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+            if self.data["config"].get("tables"):
+                self.get_free_tables(date, time)  # met le jour en cache s'il n'y est pas
+                day = self.table_cache[date]
+                if time not in day: day[time] = self.initial_tables()
+                self.allocate(day[time], size)
+            self.versions[date] = self.versions.get(date, 0) + 1
         save_data(self.data)
+        return True
 
 agent = IntelligentAgent()
 
@@ -195,26 +380,61 @@ agent = IntelligentAgent()
 # ---  ici 
 @app.get("/api/slots")
 def get_slots(date: str):
+    version = agent.data_version(date)
+    with slots_cache_lock:
+        cached = slots_cache.get(date)
+        if cached and cached[0] == version:
+            slots_cache.move_to_end(date)
+            slots_cache_stats["hits"] += 1
+            return Response(content=cached[1], media_type="application/json")
+        slots_cache_stats["misses"] += 1
+    body = json.dumps(compute_slots(date)).encode()
+    with slots_cache_lock:
+        slots_cache[date] = (version, body)
+        slots_cache.move_to_end(date)
+        if len(slots_cache) > SLOTS_CACHE_SIZE: slots_cache.popitem(last=False)
+    return Response(content=body, media_type="application/json")
+
+def compute_slots(date):
     config = agent.data["config"]
-    reservations = agent.data["reservations"].get(date, {})
     slots = []
     for h in range(config["opening_hour"], config["closing_hour"]):
         t = f"{h:02d}:00"
-        cap = agent.get_slot_capacity(date, t)
-        booked = reservations.get(t, 0)
-        slots.append({"time": t, "available": max(0, cap - booked), "full": (cap - booked) <= 0})
+        free = agent.max_party(date, t)
+        slots.append({"time": t, "available": free, "full": free <= 0})
     return slots
 
+@app.get("/api/calendar")
+def get_calendar(start: str, end: str, party_size: int = 2):
+    try:
+        d_start = datetime.strptime(start, "%Y-%m-%d")
+        d_end = datetime.strptime(end, "%Y-%m-%d")
+    except ValueError: raise HTTPException(status_code=400, detail="Dates attendues au format AAAA-MM-JJ.")
+    days = (d_end - d_start).days + 1
+    if days <= 0 or days > CALENDAR_MAX_DAYS: raise HTTPException(status_code=400, detail=f"Plage invalide (1 à {CALENDAR_MAX_DAYS} jours).")
+    if party_size < 1: raise HTTPException(status_code=400, detail="party_size doit être au moins 1.")
+
+    dates = [(d_start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+    # Plan de salle calculé pour cette seule requête : la plage ne remplit pas le cache partagé
+    tables = agent.build_free_tables(dates) if agent.data["config"].get("tables") else {}
+
+    # Une ligne JSON par jour, envoyée dès qu'elle est calculée
+    def stream():
+        for date in dates:
+            yield json.dumps(agent.day_summary(date, party_size, tables.get(date))) + "\n"
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/api/reserve")
 def reserve(req: ReservationRequest):
+    if req.party_size < 1: return {"action": "ERROR", "message": "Le nombre de personnes doit être d'au moins 1."}
+
+    # 1. Assez de place (et une table pour le groupe) ? Vérifié et réservé d'un seul coup
+    if agent.commit_booking(req.date, req.time, req.party_size, f"{req.firstname} {req.lastname}", req.email):
+        return {"action": "ACCEPT", "message": f"Confirmé à {req.time}."}
+
     cap = agent.get_slot_capacity(req.date, req.time)
     booked = agent.data["reservations"].get(req.date, {}).get(req.time, 0)
     remaining = cap - booked
-    
-    # 1. Assez de place ?
-    if remaining >= req.party_size:
-        agent.commit_booking(req.date, req.time, req.party_size, f"{req.firstname} {req.lastname}", req.email)
-        return {"action": "ACCEPT", "message": f"Confirmé à {req.time}."}
 
     # 2. Sinon, on cherche une alternative
     best = agent.find_best_slot(req.date, req.time, req.party_size)
@@ -224,7 +444,9 @@ def reserve(req: ReservationRequest):
 
     # 3. Construction du message intelligent
     msg_detail = ""
-    if remaining > 0:
+    if remaining >= req.party_size:
+        msg_detail = f"Plus de table libre pour {req.party_size} à {req.time}."
+    elif remaining > 0:
         msg_detail = f"Il ne reste que <b>{remaining} place(s)</b> à {req.time}."
     else:
         msg_detail = f"Le créneau de {req.time} est <b>complet</b>."
@@ -240,13 +462,19 @@ def chat_with_agent(chat: ChatMessage):
     try:
         cid = chat.client_id
         msg = chat.message.lower().strip()
+        if not client_limiter.allow(cid):
+            return too_many_requests("/api/chat", "limite par client")
         
         if msg in ["reset", "stop", "annuler", "recommencer", "restart"]:
-            if cid in chat_sessions: del chat_sessions[cid]
+            chat_sessions.pop(cid, None)
             return {"response": "🔄 Conversation réinitialisée. Que puis-je faire pour vous ?"}
 
-        if cid not in chat_sessions: chat_sessions[cid] = {"step": "INITIAL", "data": {}, "memory_date": None}
-        session = chat_sessions[cid]
+        with chat_sessions_lock:
+            if cid not in chat_sessions:
+                if len(chat_sessions) >= MAX_CHAT_SESSIONS: chat_sessions.popitem(last=False)
+                chat_sessions[cid] = {"step": "INITIAL", "data": {}, "memory_date": None}
+            chat_sessions.move_to_end(cid)
+            session = chat_sessions[cid]
         step = session["step"]
 
         if step == "WAITING_NEW_DATE":
@@ -283,6 +511,9 @@ def chat_with_agent(chat: ChatMessage):
 
         if step == "WAITING_CONFIRMATION":
             if msg in ["oui", "yes", "ok", "d'accord", "vas y", "c'est bon"]:
+                if session["data"].get("name"):
+                    session["step"] = "WAITING_EMAIL"
+                    return {"response": "Entendu. Confirmez votre **Email** ?"}
                 session["step"] = "WAITING_NAME"
                 return {"response": "Entendu. Quel est votre **Nom** ?"}
             elif msg in ["non", "no", "bof", "pas possible"]:
@@ -309,8 +540,16 @@ def chat_with_agent(chat: ChatMessage):
         if step == "WAITING_EMAIL":
             if not re.match(r"[^@]+@[^@]+\.[^@]+", msg): return {"response": "Email invalide. Réessayez."}
             data = session["data"]
-            agent.commit_booking(data["date"], data["time"], data.get("size", 2), data["name"], msg)
-            del chat_sessions[cid]
+            if not agent.commit_booking(data["date"], data["time"], data.get("size", 2), data["name"], msg):
+                # Le créneau a été pris entre la proposition et la confirmation
+                best = agent.find_best_slot(data["date"], data["time"], data.get("size", 2))
+                if not best:
+                    chat_sessions.pop(cid, None)
+                    return {"response": f"❌ Désolé, {data['time']} vient d'être pris et je suis complet le {data['date']} pour {data.get('size', 2)} pers."}
+                session["data"] = {"date": data["date"], "time": best["time"], "size": data.get("size", 2), "name": data["name"]}
+                session["step"] = "WAITING_CONFIRMATION"
+                return {"response": f"⚠️ {data['time']} vient d'être pris.<br>Je vous propose **{best['time']}** (pour {data.get('size', 2)} pers).<br>Ça vous va ?"}
+            chat_sessions.pop(cid, None)
             return {"response": f"🎉 Parfait ! Réservé pour **{data.get('size',2)} pers** le **{data['date']} à {data['time']}**."}
 
         # ANALYSE
@@ -358,7 +597,8 @@ def chat_with_agent(chat: ChatMessage):
         if time and prop_time == time: return {"response": f"✅ Disponible : **{date} à {prop_time}** ({size} pers).<br>Je valide ?"}
         elif time: 
             reason = f"⚠️ {time} est complet."
-            if rem > 0 and rem < size: reason = f"⚠️ Il ne reste que **{rem} places** à {time}."
+            if rem >= size: reason = f"⚠️ Plus de table libre pour {size} à {time}."
+            elif rem > 0: reason = f"⚠️ Il ne reste que **{rem} places** à {time}."
             return {"response": f"{reason}<br>Je vous propose **{prop_time}** (pour {size} pers).<br>Ça vous va ?"}
         else: return {"response": f"Pour le {date}, je propose **{prop_time}**.<br>On valide ?"}
     
@@ -370,7 +610,54 @@ def chat_with_agent(chat: ChatMessage):
 @app.get("/api/admin/data")#@app veut dire application sa represente lapplication fastapi c une technique de decorator en python
 def get_admin_data(): return agent.data
 @app.post("/api/admin/config")
-def upd_conf(c: GlobalConfigUpdate): agent.data["config"].update(c.dict(exclude={'messages'})); agent.data["messages"]=c.messages; save_data(agent.data); return {"status":"ok"}
+def upd_conf(c: GlobalConfigUpdate): agent.data["config"].update(c.dict(exclude={'messages'}, exclude_none=True)); agent.data["messages"]=c.messages; agent.invalidate(); save_data(agent.data); return {"status":"ok"}
+@app.get("/api/admin/cache_stats")
+def get_cache_stats():
+    with slots_cache_lock: return {**slots_cache_stats, "size": len(slots_cache), "max_size": SLOTS_CACHE_SIZE}
+@app.get("/api/admin/admission_stats")
+def get_admission_stats(): return {**admission, "limited": ip_limiter.rejected + client_limiter.rejected, "tracked_clients": len(ip_limiter.buckets) + len(client_limiter.buckets)}
+@app.get("/api/admin/analytics/{report}")
+def get_analytics(report: str):
+    global analytics_pool
+    if report not in analytics.REPORTS: raise HTTPException(status_code=404, detail=f"Rapport inconnu. Choix : {', '.join(analytics.REPORTS)}")
+    with analytics_lock: cached = analytics_cache.get(report)
+    if not cached or cached[0] < time.monotonic():
+        try:
+            # Copie brute prise hors verrou ; l'analyse et le calcul se font dans le worker
+            snapshot = analytics.take_snapshot(agent.data)
+            with analytics_lock:
+                now = time.monotonic()
+                cached = analytics_cache.get(report)
+                if not cached or cached[0] < now:
+                    # "spawn" : forker ce serveur multi-thread peut bloquer les workers
+                    if analytics_pool is None: analytics_pool = ProcessPoolExecutor(max_workers=ANALYTICS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                    try: future = analytics_pool.submit(analytics.REPORTS[report], snapshot)
+                    except BrokenProcessPool:
+                        analytics_pool.shutdown(wait=False); analytics_pool = None
+                        raise
+                    cached = analytics_cache[report] = (now + ANALYTICS_TTL, future, analytics_pool)
+        except BrokenProcessPool:
+            raise HTTPException(status_code=503, detail="Service de statistiques indisponible, réessayez.")
+        except Exception:
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail="Le calcul du rapport a échoué.")
+    try: result = cached[1].result()
+    except BrokenProcessPool:
+        # Un worker est mort : on jette ce pool, le prochain appel en recrée un
+        with analytics_lock:
+            if analytics_cache.get(report) is cached: del analytics_cache[report]
+            if analytics_pool is cached[2]: analytics_pool = None
+        cached[2].shutdown(wait=False)
+        raise HTTPException(status_code=503, detail="Service de statistiques indisponible, réessayez.")
+    except Exception:
+        with analytics_lock:
+            if analytics_cache.get(report) is cached: del analytics_cache[report]
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Le calcul du rapport a échoué.")
+    return {"report": report, "expires_in": max(0, round(cached[0] - time.monotonic())), "data": result}
+@app.on_event("shutdown")
+def stop_analytics():
+    if analytics_pool is not None: analytics_pool.shutdown(cancel_futures=True)
 @app.get("/api/admin/day_details")
 def get_day(date: str):
     c = agent.data["config"]
@@ -391,4 +678,5 @@ def upd_slot(u: AdminSlotUpdate):
     agent.data["overrides"][u.date][u.time]=u.capacity
     if u.date not in agent.data["reservations"]: agent.data["reservations"][u.date]={}
     agent.data["reservations"][u.date][u.time]=u.booked
+    agent.invalidate(u.date)
     save_data(agent.data); return {"status":"ok"}
\ No newline at end of file